@@ -1,12 +1,33 @@
 from typing import List, Dict, Optional, Tuple, TextIO
 from pathlib import Path
 from io import StringIO
-
-import regex
+from enum import IntEnum
+import re
 
 from format_lean.server import Server
 
-blank_line_regex = regex.compile(r'^\s*$')
+
+class Status(IntEnum):
+    """
+    What kind of block the file reader is currently in.
+    """
+    NONE = 0
+    HEADER = 1
+    TEXT = 2
+    SECTION = 3
+    SUBSECTION = 4
+    DEFINITION_TEXT = 5
+    DEFINITION_LEAN = 6
+    LEMMA_TEXT = 7
+    LEMMA_LEAN = 8
+    THEOREM_TEXT = 9
+    THEOREM_LEAN = 10
+    EXAMPLE_TEXT = 11
+    EXAMPLE_LEAN = 12
+    PROOF = 13
+    PROOF_COMMENT = 14
+    TRAD_TEXT = 15
+
 
 def dismiss_line(file_reader, line):
     pass
@@ -15,17 +36,44 @@ def dismiss_line(file_reader, line):
 class FileReader:
     def __init__(self, lean_exec_path, lean_path, readers: List = None):
         self.readers = [reader() for reader in readers]
-        self.status = ''
+        # For each status, only try the readers which can act in it.
+        self.dispatch = {status: self.dispatcher(
+                             [reader for reader in self.readers
+                              if reader.statuses is None
+                              or status in reader.statuses])
+                         for status in Status}
+        self.default_dispatch = self.dispatcher(self.readers)
+        self.status = Status.NONE
         self.output = []
+        # Last block appended to output by a reader
+        self.current_block = None
         self.filename = ''
         self.cur_line_nb = 1
         self.normal_line_handler = dismiss_line
         self.blank_line_handler = dismiss_line
         self.server = Server(lean_exec_path, lean_path)
         self.metadata = dict()
+        self.info_requests = []
+
+    @staticmethod
+    def dispatcher(readers):
+        """
+        Returns a match function for the union of the reader patterns, and
+        a dict of read methods. A line can only be picked up by a reader if
+        it matches one of the reader patterns, so most lines only need this
+        single match. When it matches, the name of the matching alternative
+        tells which reader is the first one to match, and the dict maps it to
+        the read methods of this reader and the following ones.
+        """
+        union = re.compile('|'.join(
+            f'(?P<reader{i}>{reader.regex.pattern})'
+            for i, reader in enumerate(readers)) or '(?!)')
+        read_functions = tuple(reader.read for reader in readers)
+        return union.match, {f'reader{i}': read_functions[i:]
+                             for i in range(len(readers))}
 
     def reset(self):
-        self.status = ''
+        self.status = Status.NONE
         self.normal_line_handler = dismiss_line
         self.blank_line_handler = dismiss_line
         
@@ -33,28 +81,92 @@ class FileReader:
         self.reset()
         self.cur_line_nb = 1
         self.output = []
+        self.current_block = None
+        self.metadata = dict()
+        self.info_requests = []
 
     def read_file(self, path):
         self.server.sync(path)
         self.filename = path
-        with open(str(path), 'r') as f:
-            for line in f:
-                for reader in self.readers:
-                    if reader.read(self, line):
+        dispatch = self.dispatch
+        default_dispatch = self.default_dispatch
+        # Read the whole file in one go so that it isn't kept open while
+        # lines are processed.
+        with open(str(path), 'r', encoding='utf-8') as f:
+            content = StringIO(f.read())
+        for line in content:
+            match, read_functions = dispatch.get(self.status,
+                                                 default_dispatch)
+            m = match(line)
+            if m:
+                for read in read_functions[m.lastgroup]:
+                    if read(self, line):
                         break
                 else:
-                    if blank_line_regex.match(line):
-                        self.blank_line_handler(self, line)
-                    else:
-                        self.normal_line_handler(self, line)
-                self.cur_line_nb += 1
+                    self.dispatch_line(line)
+            # Most lines end up here, so spare them a method call.
+            elif line.strip():
+                self.normal_line_handler(self, line)
+            else:
+                self.blank_line_handler(self, line)
+            self.cur_line_nb += 1
+        self.fetch_info()
+
+    def request_info(self, line, col, callback):
+        """
+        Asks for the tactic state at line and col of the current file.
+        The callback is called on it once the whole file has been read.
+        """
+        self.info_requests.append((line, col, callback))
+
+    def fetch_info(self):
+        requests, self.info_requests = self.info_requests, []
+        if not requests:
+            return
+        states = self.server.info_many(self.filename,
+                [(line, col) for line, col, _ in requests])
+        for (_, _, callback), state in zip(requests, states):
+            callback(state)
+
+    def dispatch_line(self, line):
+        """
+        Hands a line which was not picked up by any reader to the current
+        line handlers.
+        """
+        if not line.strip():
+            self.blank_line_handler(self, line)
+        else:
+            self.normal_line_handler(self, line)
 
 class LineReader:
-    regex = regex.compile(r'.*')
+    """
+    Base class for line readers. The regex is matched at the beginning of
+    each line, so patterns don't need a leading ^. When it matches, run is
+    called and should return True if the line has been consumed.
+
+    Readers looking for a fixed string can set prefix (the line starts with
+    it) or exact (the line is it, up to trailing spaces) to skip the regex
+    engine. run then receives None instead of a match object, and regex
+    should still describe the same lines.
+
+    Readers which only consume lines in some statuses can list them in
+    statuses, so that the file reader doesn't try them in other statuses.
+    """
+    regex = re.compile(r'.*')
+    prefix: Optional[str] = None
+    exact: Optional[str] = None
+    statuses: Optional[Tuple[Status, ...]] = None
 
     def read(self, file_reader, line):
-        m = self.regex.match(line)
-        if m:
+        if self.prefix is not None:
+            found = line.startswith(self.prefix)
+            m = None
+        elif self.exact is not None:
+            found = line.rstrip() == self.exact
+            m = None
+        else:
+            found = m = self.regex.match(line)
+        if found:
             return self.run(m, file_reader)
         else:
             return False
@@ -1,11 +1,26 @@
 #!/usr/bin/env python3
 from typing import List
 from dataclasses import dataclass, field
+from functools import partial
 import sys
+import re
 
-import regex
+from format_lean.line_reader import LineReader, Status, dismiss_line
 
-from format_lean.line_reader import LineReader, dismiss_line
+# Slots spare a __dict__ on each of the many objects built while reading a
+# file, but dataclass only supports them from Python 3.10 on.
+if sys.version_info >= (3, 10):
+    dataclass = partial(dataclass, slots=True)
+
+
+def join_parts(parts):
+    """
+    Returns the concatenation of a list of strings, replacing the list
+    content by this concatenation so that it is computed only once.
+    """
+    if len(parts) > 1:
+        parts[:] = [''.join(parts)]
+    return parts[0] if parts else ''
 
 
 ############
@@ -14,10 +29,18 @@ from format_lean.line_reader import LineReader, dismiss_line
 @dataclass
 class Paragraph:
     name: str = 'paragraph'
-    content: str = ''
+    content_parts: List[str] = field(default_factory=list)
+
+    @property
+    def content(self):
+        return join_parts(self.content_parts)
+
+    @content.setter
+    def content(self, value):
+        self.content_parts = [value]
 
     def append(self, line):
-        self.content = self.content + line
+        self.content_parts.append(line)
 
 
 @dataclass
@@ -29,32 +52,52 @@ class Text:
 @dataclass
 class Section:
     name: str = 'section'
-    title: str = ''
+    title_parts: List[str] = field(default_factory=list)
+
+    @property
+    def title(self):
+        return join_parts(self.title_parts)
+
+    @title.setter
+    def title(self, value):
+        self.title_parts = [value]
 
     def title_append(self, line):
-        self.title = self.title + line
+        self.title_parts.append(line)
 
 @dataclass
 class SubSection(Section):
     name: str = 'subsection'
-    title: str = ''
-
-    def title_append(self, line):
-        self.title = self.title + line
     
 @dataclass
 class Bilingual:
     """
     Base class for objects that contains both text and Lean code.
     """
-    text: str = ''
-    lean: str = ''
+    text_parts: List[str] = field(default_factory=list)
+    lean_parts: List[str] = field(default_factory=list)
+
+    @property
+    def text(self):
+        return join_parts(self.text_parts)
+
+    @text.setter
+    def text(self, value):
+        self.text_parts = [value]
+
+    @property
+    def lean(self):
+        return join_parts(self.lean_parts)
+
+    @lean.setter
+    def lean(self, value):
+        self.lean_parts = [value]
 
     def text_append(self, line):
-        self.text = self.text + line
+        self.text_parts.append(line)
 
     def lean_append(self, line):
-        self.lean = self.lean + line
+        self.lean_parts.append(line)
 
 
 @dataclass
@@ -72,12 +115,34 @@ class ProofLine:
 
 @dataclass
 class ProofItem:
+    """
+    A proof comment and the Lean lines it explains. Lean code and tactic
+    states of those lines are stored in parallel lists, the lines property
+    gathers them as ProofLine objects for templates.
+    """
     name: str = 'proof-item'
-    text: str = ''
-    lines: List[ProofLine] = field(default_factory=list)
+    text_parts: List[str] = field(default_factory=list)
+    leans: List[str] = field(default_factory=list)
+    tactic_states_left: List[str] = field(default_factory=list)
+    tactic_states_right: List[str] = field(default_factory=list)
+
+    @property
+    def lines(self):
+        return [ProofLine(lean=lean, tactic_state_left=tsl,
+                          tactic_state_right=tsr)
+                for lean, tsl, tsr in zip(self.leans,
+                    self.tactic_states_left, self.tactic_states_right)]
+
+    @property
+    def text(self):
+        return join_parts(self.text_parts)
+
+    @text.setter
+    def text(self, value):
+        self.text_parts = [value]
 
     def text_append(self, line):
-        self.text = self.text + line
+        self.text_parts.append(line)
 
 @dataclass
 class Proof:
@@ -122,285 +187,249 @@ class Trad(Paragraph):
 #################
 
 class Title(LineReader):
-    regex = regex.compile(r'^-- Title: (.*)$')
+    regex = re.compile(r'-- Title: (.*)$')
 
     def run(self, m, file_reader):
         file_reader.metadata['title'] = m.group(1)
 
 
 class HeaderBegin(LineReader):
-    regex = regex.compile(r'-- begin header\s*')
+    regex = re.compile(r'-- begin header\s*')
+    prefix = '-- begin header'
 
     def run(self, m, file_reader):
-        file_reader.status = 'header'
+        file_reader.status = Status.HEADER
         file_reader.normal_line_handler = dismiss_line
         return True
 
 
 class HeaderEnd(LineReader):
-    regex = regex.compile(r'-- end header\s*')
+    regex = re.compile(r'-- end header\s*')
+    prefix = '-- end header'
 
     def run(self, m, file_reader):
-        file_reader.status = ''
+        file_reader.status = Status.NONE
         return True
 
 
 class TextBegin(LineReader):
-    regex = regex.compile(r'\s*/-\s*$')
+    regex = re.compile(r'\s*/-\s*$')
 
     def run(self, m, file_reader):
-        file_reader.status = 'text'
-        text = Text()
-        text.paragraphs = [Paragraph()]
+        file_reader.status = Status.TEXT
+        text = Text(paragraphs=[Paragraph()])
         file_reader.output.append(text)
+        file_reader.current_block = text
+        paragraphs = text.paragraphs
         def normal_line(file_reader, line):
-            text.paragraphs[-1].append(line)
+            paragraphs[-1].append(line)
         file_reader.normal_line_handler = normal_line
         def blank_line(file_reader, line):
-            text.paragraphs.append(Paragraph())
+            paragraphs.append(Paragraph())
         file_reader.blank_line_handler = blank_line
         return True
 
 
-class TextEnd(LineReader):
-    regex = regex.compile(r'-/')
-
-    def run(self, m, file_reader):
-        if file_reader.status is not 'text':
-            return False
-        file_reader.reset()
-        return True
-
-
 class SectionBegin(LineReader):
-    regex = regex.compile(r'\s*/-\s*Section\s*$')
+    regex = re.compile(r'\s*/-\s*Section\s*$')
 
     def run(self, m, file_reader):
-        file_reader.status = 'section'
+        file_reader.status = Status.SECTION
         sec = Section()
         file_reader.output.append(sec)
+        file_reader.current_block = sec
+        title_append = sec.title_append
         def normal_line(file_reader, line):
-            sec.title_append(line)
+            title_append(line)
         file_reader.normal_line_handler = normal_line
         file_reader.blank_line_handler = normal_line
         return True
 
 
-class SectionEnd(LineReader):
-    regex = regex.compile(r'-/')
-
-    def run(self, m, file_reader):
-        if file_reader.status is not 'section':
-            return False
-        file_reader.reset()
-        return True
-
-
 class SubSectionBegin(LineReader):
-    regex = regex.compile(r'\s*/-\s*Sub-section\s*$')
+    regex = re.compile(r'\s*/-\s*Sub-section\s*$')
 
     def run(self, m, file_reader):
-        file_reader.status = 'subsection'
+        file_reader.status = Status.SUBSECTION
         sec = SubSection()
         file_reader.output.append(sec)
+        file_reader.current_block = sec
+        title_append = sec.title_append
         def normal_line(file_reader, line):
-            sec.title_append(line)
+            title_append(line)
         file_reader.normal_line_handler = normal_line
         file_reader.blank_line_handler = normal_line
         return True
 
 
-class SubSectionEnd(LineReader):
-    regex = regex.compile(r'-/')
-
-    def run(self, m, file_reader):
-        if file_reader.status is not 'subsection':
-            return False
-        file_reader.reset()
-        return True
-
-
 class DefinitionBegin(LineReader):
-    regex = regex.compile(r'\s*/-\s*Definition\s*$')
+    regex = re.compile(r'\s*/-\s*Definition\s*$')
 
     def run(self, m, file_reader):
-        file_reader.status = 'definition_text'
+        file_reader.status = Status.DEFINITION_TEXT
         defi = Definition()
         file_reader.output.append(defi)
+        file_reader.current_block = defi
+        text_append = defi.text_append
         def normal_line(file_reader, line):
-            defi.text_append(line)
+            text_append(line)
         file_reader.normal_line_handler = normal_line
         file_reader.blank_line_handler = normal_line
         return True
 
 
-class DefinitionEnd(LineReader):
-    regex = regex.compile(r'-/')
-
-    def run(self, m, file_reader):
-        if file_reader.status is not 'definition_text':
-            return False
-        file_reader.status = 'definition_lean'
-        defi = file_reader.output[-1]
-        def normal_line(file_reader, line):
-            defi.lean_append(line)
-        file_reader.normal_line_handler = normal_line
-        def blank_line(file_reader, line):
-            file_reader.reset()
-        file_reader.blank_line_handler = blank_line
-        return True
-
-
 class LemmaBegin(LineReader):
-    regex = regex.compile(r'\s*/-\s*Lemma\s*$')
+    regex = re.compile(r'\s*/-\s*Lemma\s*$')
 
     def run(self, m, file_reader):
-        file_reader.status = 'lemma_text'
+        file_reader.status = Status.LEMMA_TEXT
         lemma = Lemma()
         file_reader.output.append(lemma)
+        file_reader.current_block = lemma
+        text_append = lemma.text_append
         def normal_line(file_reader, line):
-            lemma.text_append(line)
+            text_append(line)
         file_reader.normal_line_handler = normal_line
         file_reader.blank_line_handler = normal_line
         return True
 
 
-class LemmaEnd(LineReader):
-    regex = regex.compile(r'-/')
-
-    def run(self, m, file_reader):
-        if file_reader.status is not 'lemma_text':
-            return False
-        file_reader.status = 'lemma_lean'
-        lemma = file_reader.output[-1]
-        def normal_line(file_reader, line):
-            lemma.lean_append(line)
-        file_reader.normal_line_handler = normal_line
-        return True
-
-
 class TheoremBegin(LineReader):
-    regex = regex.compile(r'\s*/-\s*Theorem\s*$')
+    regex = re.compile(r'\s*/-\s*Theorem\s*$')
 
     def run(self, m, file_reader):
-        file_reader.status = 'theorem_text'
+        file_reader.status = Status.THEOREM_TEXT
         theorem = Theorem()
         file_reader.output.append(theorem)
+        file_reader.current_block = theorem
+        text_append = theorem.text_append
         def normal_line(file_reader, line):
-            theorem.text_append(line)
+            text_append(line)
         file_reader.normal_line_handler = normal_line
         file_reader.blank_line_handler = normal_line
         return True
 
 
-class TheoremEnd(LineReader):
-    regex = regex.compile(r'-/')
-
-    def run(self, m, file_reader):
-        if file_reader.status is not 'theorem_text':
-            return False
-        file_reader.status = 'theorem_lean'
-        theorem = file_reader.output[-1]
-        def normal_line(file_reader, line):
-            theorem.lean_append(line)
-        file_reader.normal_line_handler = normal_line
-        return True
-
-
 class ExampleBegin(LineReader):
-    regex = regex.compile(r'\s*/-\s*Example\s*$')
+    regex = re.compile(r'\s*/-\s*Example\s*$')
 
     def run(self, m, file_reader):
-        file_reader.status = 'example_text'
+        file_reader.status = Status.EXAMPLE_TEXT
         example = Example()
         file_reader.output.append(example)
+        file_reader.current_block = example
+        text_append = example.text_append
         def normal_line(file_reader, line):
-            example.text_append(line)
+            text_append(line)
         file_reader.normal_line_handler = normal_line
         file_reader.blank_line_handler = normal_line
         return True
 
 
-class ExampleEnd(LineReader):
-    regex = regex.compile(r'-/')
-
-    def run(self, m, file_reader):
-        if file_reader.status is not 'example_text':
-            return False
-        file_reader.status = 'example_lean'
-        example = file_reader.output[-1]
-        def normal_line(file_reader, line):
-            example.lean_append(line)
-        file_reader.normal_line_handler = normal_line
-        return True
-
-
 class ProofBegin(LineReader):
-    regex = regex.compile(r'^begin\s*$')
+    regex = re.compile(r'begin\s*$')
+    exact = 'begin'
 
     def run(self, m, file_reader):
-        file_reader.status = 'proof'
+        file_reader.status = Status.PROOF
         file_reader.normal_line_handler = dismiss_line # Proofs shouldn't start with normal line
         return True
 
 
 class ProofEnd(LineReader):
-    regex = regex.compile(r'^end\s*$')  # Beware of match end
+    regex = re.compile(r'end\s*$')  # Beware of match end
+    exact = 'end'
+    statuses = (Status.PROOF,)
 
     def run(self, m, file_reader):
-        if file_reader.status is not 'proof':
+        if file_reader.status != Status.PROOF:
             return False
         file_reader.reset()
         return True
 
 
 class ProofComment(LineReader):
-    regex = regex.compile(r'^[\s{]*-- (.*)$')
+    regex = re.compile(r'[\s{]*-- (.*)$')
+    statuses = (Status.PROOF, Status.PROOF_COMMENT)
 
     def run(self, m, file_reader):
-        if file_reader.status == 'proof':
+        if file_reader.status == Status.PROOF:
             item = ProofItem()
             try:
-                file_reader.output[-1].proof_append(item)
+                file_reader.current_block.proof_append(item)
             except:
                 print(f"Something is wrong on line {file_reader.cur_line_nb}.  Maybe we are trying to comment on a proof of a lemma whose statement has no human readable version.") 
                 sys.exit(1)
-            file_reader.status = 'proof_comment'
-        elif file_reader.status == 'proof_comment':
-            item = file_reader.output[-1].proof.items[-1]
+            file_reader.status = Status.PROOF_COMMENT
+        elif file_reader.status == Status.PROOF_COMMENT:
+            item = file_reader.current_block.proof.items[-1]
         else:
             return False
         item.text_append(' ' + m.group(1))
+        leans = item.leans
+        states_left = item.tactic_states_left
+        states_right = item.tactic_states_right
+        request_info = file_reader.request_info
         def normal_line(file_reader, line):
-            file_reader.status = 'proof'
-            tsl = file_reader.server.info(file_reader.filename,
-                    file_reader.cur_line_nb, 1)
-            tsr = file_reader.server.info(file_reader.filename,
-                    file_reader.cur_line_nb, len(line))
-            item.lines.append(
-                    ProofLine(lean=line, 
-                        tactic_state_left=tsl, tactic_state_right=tsr))
+            file_reader.status = Status.PROOF
+            index = len(leans)
+            leans.append(line)
+            states_left.append('')
+            states_right.append('')
+            line_nb = file_reader.cur_line_nb
+            request_info(line_nb, 1, partial(states_left.__setitem__, index))
+            request_info(line_nb, len(line),
+                    partial(states_right.__setitem__, index))
         file_reader.normal_line_handler = normal_line
         return True
 
 class TradBegin(LineReader):
-    regex = regex.compile(r'\s*/-\s*trad ([^\s]*)\s*$')
+    regex = re.compile(r'\s*/-\s*trad ([^\s]*)\s*$')
 
     def run(self, m, file_reader):
-        file_reader.status = 'trad_text'
+        file_reader.status = Status.TRAD_TEXT
         thm = Trad(kind=m.group(1))
         file_reader.output.append(thm)
+        file_reader.current_block = thm
+        append = thm.append
         def normal_line(file_reader, line):
-            thm.append(line)
+            append(line)
         file_reader.normal_line_handler = normal_line
         file_reader.blank_line_handler = normal_line
         return True
 
-class TradEnd(LineReader):
-    regex = regex.compile(r'-/')
+
+class BlockEnd(LineReader):
+    """
+    Closes the current comment block, whatever kind of block it is.
+    """
+    regex = re.compile(r'-/')
+    prefix = '-/'
+    # Statuses of blocks which simply end here
+    closing_statuses = (Status.TEXT, Status.SECTION, Status.SUBSECTION,
+                        Status.TRAD_TEXT)
+    # Statuses of blocks whose text is followed by Lean code
+    lean_status = {Status.DEFINITION_TEXT: Status.DEFINITION_LEAN,
+                   Status.LEMMA_TEXT: Status.LEMMA_LEAN,
+                   Status.THEOREM_TEXT: Status.THEOREM_LEAN,
+                   Status.EXAMPLE_TEXT: Status.EXAMPLE_LEAN}
+    statuses = closing_statuses + tuple(lean_status)
 
     def run(self, m, file_reader):
-        if file_reader.status is not 'trad_text':
+        status = file_reader.status
+        if status in self.closing_statuses:
+            file_reader.reset()
+            return True
+        if status not in self.lean_status:
             return False
-        file_reader.reset()
+        file_reader.status = self.lean_status[status]
+        obj = file_reader.current_block
+        lean_append = obj.lean_append
+        def normal_line(file_reader, line):
+            lean_append(line)
+        file_reader.normal_line_handler = normal_line
+        if status == Status.DEFINITION_TEXT:
+            def blank_line(file_reader, line):
+                file_reader.reset()
+            file_reader.blank_line_handler = blank_line
         return True
@@ -21,10 +21,12 @@ def color(obj):
         obj.lean = highlight(obj.lean, lexer, formatter)
     if hasattr(obj, 'proof'):
         for proof_item in obj.proof.items:
-            for line in proof_item.lines:
-                line.lean = highlight(line.lean, lexer, formatter)
-                line.tactic_state_left = highlight(line.tactic_state_left, lexer, formatter)
-                line.tactic_state_right = highlight(line.tactic_state_right, lexer, formatter)
+            proof_item.leans = [highlight(lean, lexer, formatter)
+                                for lean in proof_item.leans]
+            proof_item.tactic_states_left = [highlight(ts, lexer, formatter)
+                    for ts in proof_item.tactic_states_left]
+            proof_item.tactic_states_right = [highlight(ts, lexer, formatter)
+                    for ts in proof_item.tactic_states_right]
     return obj
 
 def prepare(content):
@@ -50,19 +52,18 @@ class Renderer:
 
     def transform_text(self, text):
         return Text(paragraphs=[
-            Paragraph(content=self.render_markdown(par.content))
+            Paragraph(content_parts=[self.render_markdown(par.content)])
             for par in text.paragraphs])
 
     def transform_theorem(self, theorem):
         theorem.text = self.render_markdown(theorem.text)
         for proof_item in theorem.proof.items:
             proof_item.text = self.render_markdown(proof_item.text, par=False)
-            for proof_line in proof_item.lines:
-                for r, s in self.ts_filters:
-                    proof_line.tactic_state_left = r.sub(
-                            s, proof_line.tactic_state_left)
-                    proof_line.tactic_state_right = r.sub(
-                            s, proof_line.tactic_state_right)
+            for r, s in self.ts_filters:
+                proof_item.tactic_states_left = [r.sub(s, ts)
+                        for ts in proof_item.tactic_states_left]
+                proof_item.tactic_states_right = [r.sub(s, ts)
+                        for ts in proof_item.tactic_states_right]
         return theorem
 
     transform_example = transform_theorem
@@ -1,4 +1,4 @@
-import os, subprocess, json
+import os, subprocess, json, threading
 
 class LeanError(Exception):
     pass
@@ -21,14 +21,39 @@ class Server:
         self.proc.stdin.write(s)
         self.proc.stdout.readline()
 
-    def info(self, filename, line, col):
+    def info_request(self, filename, line, col):
         self.seq_num += 1
-        s = f'{{"seq_num": {self.seq_num}, "command":"info", ' \
-            f'"file_name": "{filename}", ' \
-            f'"line": {line},"column":{col}}}\n'
-        self.proc.stdin.write(s)
-        ret = json.loads(self.proc.stdout.readline().rstrip())
+        return f'{{"seq_num": {self.seq_num}, "command":"info", ' \
+               f'"file_name": "{filename}", ' \
+               f'"line": {line},"column":{col}}}\n'
+
+    @staticmethod
+    def info_state(ret):
         if 'record' in ret:
             return ret['record']['state']
         else:
             raise LeanError(ret)
+
+    def info_many(self, filename, positions):
+        """
+        Returns the tactic states at a list of (line, column) positions.
+        All requests are sent before waiting for the answers, so we pay for
+        one round-trip to the server instead of one per position.
+        """
+        first_seq_num = self.seq_num + 1
+        requests = [self.info_request(filename, line, col)
+                    for line, col in positions]
+        # Writing from another thread avoids a deadlock if the server fills
+        # its output pipe before reading all our requests. It is a daemon so
+        # that it can't block exit if reading answers fails.
+        writer = threading.Thread(target=self.proc.stdin.writelines,
+                                  args=(requests,), daemon=True)
+        writer.start()
+        answers = dict()
+        while len(answers) < len(requests):
+            ret = json.loads(self.proc.stdout.readline().rstrip())
+            if ret.get('seq_num', 0) >= first_seq_num:
+                answers[ret['seq_num']] = ret
+        writer.join()
+        return [self.info_state(answers[first_seq_num + i])
+                for i in range(len(requests))]